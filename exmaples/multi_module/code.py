@@ -0,0 +1,63 @@
+import time
+import board
+import busio
+from adafruit_espatcontrol.adafruit_espatcontrol import ESP_ATcontrol, OKError
+from access_point import AccessPoint, ENCRYPTION_WPA2_PSK
+from access_point_pool import AccessPointPool
+from webserver import WebServer
+from dns_server import DnsServer
+
+# Get wifi details and more from a secrets.py file
+try:
+    from ap_secrets import secrets
+except ImportError:
+    print("All secret keys are kept in ap_secrets.py, please add them there!")
+    raise
+
+# Initialize UART connections to two ESP-01 WiFi Modules.
+# Use large buffers as we're not using hardware flow control.
+uart_0 = busio.UART(board.GP16, board.GP17, receiver_buffer_size=2048)
+uart_1 = busio.UART(board.GP4, board.GP5, receiver_buffer_size=2048)
+
+esp_0 = ESP_ATcontrol(uart_0, 115200, debug=False)
+esp_1 = ESP_ATcontrol(uart_1, 115200, debug=False)
+
+print("Resetting ESP modules")
+esp_0.soft_reset()
+esp_1.soft_reset()
+
+ap_0 = AccessPoint(esp_0)
+ap_1 = AccessPoint(esp_1)
+pool = AccessPointPool([ap_0, ap_1])
+server = None
+stats_stamp = time.monotonic()
+
+running = True
+while running:
+    try:
+        if server == None:
+            print("Configuring APs...")
+            # Separate channels, so the two APs don't share the air time.
+            # Link ids only go up to 4, DnsServer takes conn_limit + 1.
+            ap_0.configure_ap({"ssid": secrets["ssid"] + "-0", "password": secrets["password"]},
+                              1, ENCRYPTION_WPA2_PSK, 3, False)
+            ap_1.configure_ap({"ssid": secrets["ssid"] + "-1", "password": secrets["password"]},
+                              11, ENCRYPTION_WPA2_PSK, 3, False)
+            server = WebServer(pool, debug=False, max_load=6)
+            server.register_static_handler("/", "www")
+            server.listen(80)
+            dns = DnsServer(pool)
+            dns.listen(53)
+
+        # Responses to clients of both modules are sent a chunk at a time,
+        # interleaved, with DNS queries answered in the same cycle
+        server.do_receive_cycle(timeout=1, on_message=dns.handle_message)
+
+        if time.monotonic() - stats_stamp > 60:
+            stats_stamp = time.monotonic()
+            for module_index in range(len(pool.modules)):
+                print("Module", module_index, pool.stats[module_index])
+
+    except (ValueError, RuntimeError, OKError) as e:
+        print("Failed, closing\n", e)
+        running = False
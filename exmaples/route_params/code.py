@@ -42,6 +42,8 @@ while running:
             print("IP address:", ap.get_ip())
             server = WebServer(ap, debug=True)
             server.register_handler("GET", "/resource/:resource_id", get_resource_handler)
+            # Identical requests within a second are answered from the cache
+            server.enable_cache("GET", "/resource/:resource_id", 1)
             server.listen(80)
 
         server.do_receive_cycle()
@@ -3,7 +3,7 @@ import gc
 from adafruit_espatcontrol.adafruit_espatcontrol import ESP_ATcontrol
 
 try:
-    from typing import Tuple, Dict
+    from typing import Tuple, Dict, List
 except ImportError:
     pass
 
@@ -24,6 +24,10 @@ class AccessPoint:
     def __init__(self, esp: ESP_ATcontrol) -> None:
         self._esp = esp
         self.conn_limit = 1
+        # Links reported by unsolicited "<link_id>,CLOSED" or "<link_id>,CONNECT"
+        # notices seen while receiving, a new connection ends the previous one
+        self._notice_line = bytearray()
+        self._closed_links: List[int] = []
 
     def configure_ap(self, secrets: Dict[str, str], channel: int = 5, encryption: int = ENCRYPTION_OPEN, conn_limit: int = 1, hidden: bool = False) -> None:
         if "ssid" not in secrets:
@@ -55,6 +59,10 @@ class AccessPoint:
                 return str(line[13:-1], "utf-8")
         raise RuntimeError("Couldn't find IP address")
 
+    def is_client_link(self, link_id: int) -> bool:
+        """Whether link_id is one of the TCP links clients connect on"""
+        return link_id in range(0, self.conn_limit)
+
     def start_listen(self, port: int = 80) -> None:
         self._port = port
         # AT+CIPDINFO = 1
@@ -65,6 +73,20 @@ class AccessPoint:
         cmd = 'AT+CIPSERVER=0,%d' % self._port
         self._esp.at_response(cmd)
 
+    @property
+    def in_waiting(self) -> int:
+        """Number of bytes received from the module but not read yet"""
+        return self._esp._uart.in_waiting
+
+    def poll(self) -> int:
+        """Like in_waiting, but restarts the flow when nothing is waiting, as
+        socket_receive does. A caller that only receives from modules with
+        data waiting must poll, or a module stopped by its last read stalls."""
+        in_waiting = self._esp._uart.in_waiting
+        if not in_waiting:
+            self._esp.hw_flow(True)
+        return in_waiting
+
     def socket_receive(self, timeout: int = 5) -> Tuple[int, bytearray]:
         # pylint: disable=too-many-nested-blocks, too-many-branches
         """Check for incoming data over the open socket, returns bytes"""
@@ -84,6 +106,7 @@ class AccessPoint:
                     # read one byte at a time
                     self._esp._ipdpacket[i] = self._esp._uart.read(1)[0]
                     if chr(self._esp._ipdpacket[0]) != "+":
+                        self._check_notice(self._esp._ipdpacket[0])
                         i = 0  # keep goin' till we start with +
                         continue
                     i += 1
@@ -138,6 +161,26 @@ class AccessPoint:
         gc.collect()
         return (link_id, ret)
 
+    def _check_notice(self, char: int) -> None:
+        if len(self._notice_line) > 16:
+            self._notice_line = bytearray()
+        self._notice_line.append(char)
+        if char == 0x0A:
+            line = bytes(self._notice_line)
+            if line.endswith(b",CLOSED\r\n") or line.endswith(b",CONNECT\r\n"):
+                try:
+                    self._closed_links.append(int(line[:line.find(b",")]))
+                except ValueError:
+                    pass
+            self._notice_line = bytearray()
+
+    def pop_closed_links(self) -> List[int]:
+        """Return the link ids reported closed (or reconnected) by the module
+        since the last call"""
+        closed_links = self._closed_links
+        self._closed_links = []
+        return closed_links
+
     def socket_send(self, link_id: int, buffer: bytes, timeout: int = 1) -> bool:
         """Send data over the already-opened socket, buffer must be bytes"""
         cmd = "AT+CIPSEND=%d" % link_id
@@ -159,18 +202,20 @@ class AccessPoint:
         self._esp._uart.write(buffer)
         stamp = time.monotonic()
         response = b""
+        sent = False
         while (time.monotonic() - stamp) < timeout:
             if self._esp._uart.in_waiting:
                 response += self._esp._uart.read(self._esp._uart.in_waiting)
                 response_parts = response.split(b"\r\n")
                 if b"SEND OK" in response_parts:
+                    sent = True
                     break
                 if b"ERROR" in response_parts:
                     break
         if self._esp._debug:
             print("<---", response)
         # Get newlines off front and back, then split into lines
-        return True
+        return sent
 
     def socket_disconnect(self, link_id: int) -> None:
         cmd = "AT+CIPCLOSE=%d" % link_id
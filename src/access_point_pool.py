@@ -0,0 +1,120 @@
+import time
+from access_point import AccessPoint
+from adafruit_espatcontrol.adafruit_espatcontrol import OKError
+
+try:
+    from typing import Tuple, Dict, List
+except ImportError:
+    pass
+
+# Module link ids stay below this, TCP and UDP ones alike
+LINK_ID_STRIDE = 16
+
+
+class AccessPointPool:
+    """Several ESP modules, each configured as its own AccessPoint, driven as
+    one by WebServer and DnsServer. Link ids are unique across the pool:
+    module index * LINK_ID_STRIDE + link id on the module."""
+
+    def __init__(self, modules: List[AccessPoint]) -> None:
+        self.modules = modules
+        self.stats: List[Dict[str, int]] = []
+        for _ in modules:
+            self.stats.append({
+                "received": 0,
+                "received_bytes": 0,
+                "sent": 0,
+                "sent_bytes": 0,
+                "send_errors": 0
+            })
+        # Module checked first by the next receive, so none is starved
+        self._next_module = 0
+
+    @property
+    def conn_limit(self) -> int:
+        return sum([module.conn_limit for module in self.modules])
+
+    @property
+    def in_waiting(self) -> int:
+        return sum([module.in_waiting for module in self.modules])
+
+    def get_link_id(self, module_index: int, module_link_id: int) -> int:
+        return module_index * LINK_ID_STRIDE + module_link_id
+
+    def _split_link_id(self, link_id: int) -> Tuple[int, int]:
+        module_index = link_id // LINK_ID_STRIDE
+        if link_id < 0 or module_index >= len(self.modules):
+            raise RuntimeError("Invalid link id: %d" % link_id)
+        return (module_index, link_id % LINK_ID_STRIDE)
+
+    def is_client_link(self, link_id: int) -> bool:
+        module_index = link_id // LINK_ID_STRIDE
+        return link_id >= 0 and module_index < len(self.modules) \
+            and self.modules[module_index].is_client_link(link_id % LINK_ID_STRIDE)
+
+    def get_ip(self) -> str:
+        return self.modules[0].get_ip()
+
+    def start_listen(self, port: int = 80) -> None:
+        for module in self.modules:
+            module.start_listen(port)
+
+    def stop_listen(self) -> None:
+        for module in self.modules:
+            module.stop_listen()
+
+    def socket_receive(self, timeout: int = 5, poll_timeout: float = 0.1) -> Tuple[int, bytearray]:
+        """Receive the next message from whichever module has data, checking
+        them round robin starting after the one served last."""
+        stamp = time.monotonic()
+        while True:
+            for step in range(len(self.modules)):
+                module_index = (self._next_module + step) % len(self.modules)
+                module = self.modules[module_index]
+                if not module.poll():
+                    continue
+                (link_id, data) = module.socket_receive(poll_timeout)
+                if link_id < 0:
+                    continue
+                self._next_module = (module_index + 1) % len(self.modules)
+                stats = self.stats[module_index]
+                stats["received"] += 1
+                stats["received_bytes"] += len(data)
+                return (self.get_link_id(module_index, link_id), data)
+            if (time.monotonic() - stamp) >= timeout:
+                return (-1, bytearray())
+
+    def socket_send(self, link_id: int, buffer: bytes, timeout: int = 1) -> bool:
+        (module_index, module_link_id) = self._split_link_id(link_id)
+        stats = self.stats[module_index]
+        try:
+            sent = self.modules[module_index].socket_send(
+                module_link_id, buffer, timeout)
+        except (OKError, RuntimeError):
+            stats["send_errors"] += 1
+            raise
+        if sent:
+            stats["sent"] += 1
+            stats["sent_bytes"] += len(buffer)
+        else:
+            stats["send_errors"] += 1
+        return sent
+
+    def socket_disconnect(self, link_id: int) -> None:
+        (module_index, module_link_id) = self._split_link_id(link_id)
+        self.modules[module_index].socket_disconnect(module_link_id)
+
+    def pop_closed_links(self) -> List[int]:
+        closed_links = []
+        for module_index in range(len(self.modules)):
+            for link_id in self.modules[module_index].pop_closed_links():
+                closed_links.append(self.get_link_id(module_index, link_id))
+        return closed_links
+
+    def udp_listen(self, port: int, link_id: int) -> None:
+        (module_index, module_link_id) = self._split_link_id(link_id)
+        self.modules[module_index].udp_listen(port, module_link_id)
+
+    def udp_close(self, link_id: int) -> None:
+        (module_index, module_link_id) = self._split_link_id(link_id)
+        self.modules[module_index].udp_close(module_link_id)
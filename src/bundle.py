@@ -0,0 +1,105 @@
+import struct
+
+try:
+    import mmap
+except ImportError:
+    # Not available on CircuitPython, chunks are read through a buffer there
+    mmap = None
+
+try:
+    from typing import Iterator, Tuple
+    BundleEntry = Tuple[str, int, int, int, int]
+except ImportError:
+    pass
+
+BUNDLE_MAGIC = b"WWWB"
+BUNDLE_VERSION = 1
+# magic, version, content type count, entry count, types offset, names offset, data offset
+HEADER_FORMAT = "<4sBBHIII"
+HEADER_SIZE = 20
+# name offset, name length, content type index, flags, offset, length, gzip offset, gzip length
+RECORD_FORMAT = "<IHBBIIII"
+RECORD_SIZE = 24
+
+
+class AssetBundle:
+    """Read side of a bundle packed by tools/pack_www.py: a header, a path
+    sorted record table, content types, path names, then the file data.
+    The record table and names are loaded once, lookups are a binary search
+    and file data is read from one open handle."""
+
+    def __init__(self, path: str, chunk_size: int = 1024) -> None:
+        self._file = open(path, "rb")
+        (magic, version, type_count, self.entry_count, types_offset, names_offset,
+         data_offset) = struct.unpack(HEADER_FORMAT, self._file.read(HEADER_SIZE))
+        if magic != BUNDLE_MAGIC or version != BUNDLE_VERSION:
+            self._file.close()
+            raise ValueError("Not an asset bundle: " + path)
+        self._records = self._file.read(self.entry_count * RECORD_SIZE)
+        self._file.seek(types_offset)
+        types = self._file.read(names_offset - types_offset)
+        self._content_types = []
+        pos = 0
+        for _ in range(type_count):
+            type_length = types[pos]
+            self._content_types.append(
+                str(types[pos+1:pos+1+type_length], "utf-8"))
+            pos += type_length + 1
+        self._names = self._file.read(data_offset - names_offset)
+        self._chunk_size = chunk_size
+        self._map = None
+        if mmap is not None:
+            self._map = mmap.mmap(
+                self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._buffer = memoryview(bytearray(chunk_size))
+
+    def _record(self, index: int) -> Tuple[int, int, int, int, int, int, int, int]:
+        return struct.unpack_from(RECORD_FORMAT, self._records, index * RECORD_SIZE)
+
+    def find(self, path: str) -> BundleEntry:
+        """Return (content type, offset, length, gzip offset, gzip length)
+        of path, or None if it isn't in the bundle."""
+        key = path.lstrip("/").encode()
+        low = 0
+        high = self.entry_count - 1
+        while low <= high:
+            middle = (low + high) // 2
+            record = self._record(middle)
+            name = self._names[record[0]:record[0]+record[1]]
+            if name == key:
+                return (self._content_types[record[2]],) + record[4:]
+            if name < key:
+                low = middle + 1
+            else:
+                high = middle - 1
+        return None
+
+    def read_chunks(self, offset: int, length: int) -> Iterator[memoryview]:
+        """Yield length bytes of bundle data from offset. Without mmap the
+        chunks share one buffer, so each is only valid until the next."""
+        if self._map is not None:
+            view = memoryview(self._map)
+            for pos in range(offset, offset + length, self._chunk_size):
+                yield view[pos:min(pos + self._chunk_size, offset + length)]
+            return
+        while length > 0:
+            # Seek every time, other responses may read in between
+            self._file.seek(offset)
+            count = self._file.readinto(
+                self._buffer[:min(self._chunk_size, length)])
+            if not count:
+                break
+            offset += count
+            length -= count
+            yield self._buffer[:count]
+
+    def close(self) -> None:
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                # A chunk view is still referenced somewhere, the map is
+                # released with it
+                pass
+        self._file.close()
@@ -1,8 +1,9 @@
 import binascii
 from access_point import AccessPoint
+from access_point_pool import AccessPointPool
 
 try:
-    from typing import Tuple
+    from typing import Tuple, Union
 except ImportError:
     pass
 
@@ -226,20 +227,29 @@ class DnsAnswer:
 
 class DnsServer:
 
-    def __init__(self, ap: AccessPoint, debug: bool = False) -> None:
+    def __init__(self, ap: Union[AccessPoint, AccessPointPool], debug: bool = False) -> None:
         self._ap = ap
         self._debug = debug
-        # To avoid link collision with TCP
-        self._link_id = ap.conn_limit + 1
-        self._local_ip = ap.get_ip()
+        # One UDP link per module, above its TCP links to avoid collision,
+        # answering with the IP of that module
+        self._local_ips = {}
+        if isinstance(ap, AccessPointPool):
+            for module_index in range(len(ap.modules)):
+                module = ap.modules[module_index]
+                link_id = ap.get_link_id(module_index, module.conn_limit + 1)
+                self._local_ips[link_id] = module.get_ip()
+        else:
+            self._local_ips[ap.conn_limit + 1] = ap.get_ip()
 
     def listen(self, port: int) -> None:
-        self._ap.udp_listen(port, self._link_id)
+        for link_id in self._local_ips:
+            self._ap.udp_listen(port, link_id)
         if self._debug:
             print("DNSSERVER -> Listening on port: ", port)
 
     def close(self) -> None:
-        self._ap.udp_close(self._link_id)
+        for link_id in self._local_ips:
+            self._ap.udp_close(link_id)
         if self._debug:
             print("DNSSERVER -> Closed")
 
@@ -252,7 +262,7 @@ class DnsServer:
 
     def handle_message(self, message: Tuple[int, bytearray]) -> None:
         (link_id, data) = message
-        if len(data) > 16 and link_id == self._link_id:
+        if len(data) > 16 and link_id in self._local_ips:
             header = DnsHeader()
             header.parse(data[:DnsHeader.BYTE_LENGTH])
             question = DnsQuestion()
@@ -272,7 +282,7 @@ class DnsServer:
             answer.CLASS = question.CLASS
             answer.TTL = 300
 
-            answer.set_data(self._local_ip)
+            answer.set_data(self._local_ips[link_id])
 
             if self._debug:
                 print('DNSSERVER -> Reponse header: ', header)
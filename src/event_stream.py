@@ -0,0 +1,85 @@
+import time
+from access_point import AccessPoint
+from adafruit_espatcontrol.adafruit_espatcontrol import OKError
+
+try:
+    from typing import Dict, List
+except ImportError:
+    pass
+
+KEEP_ALIVE_MESSAGE = b": keep-alive\n\n"
+
+
+def build_event(data: str, event: str = None, event_id: str = None) -> bytes:
+    event_lines = []
+    if event_id is not None:
+        event_lines.append("id: " + event_id)
+    if event is not None:
+        event_lines.append("event: " + event)
+    for data_line in data.split("\n"):
+        event_lines.append("data: " + data_line)
+    event_lines.append("\n")
+    return "\n".join(event_lines).encode()
+
+
+class EventStream:
+    """Server-Sent Events channel. Links subscribed by WebServer stay open and
+    every event is written to them with a single socket_send."""
+
+    def __init__(self, ap: AccessPoint, keep_alive_interval: int = 15, debug: bool = False) -> None:
+        self._ap = ap
+        self._debug = debug
+        self.keep_alive_interval = keep_alive_interval
+        # Time of the last write, by subscribed link id
+        self._subscribers: Dict[int, float] = {}
+
+    @property
+    def subscribers(self) -> List[int]:
+        return list(self._subscribers)
+
+    def subscribe(self, link_id: int) -> None:
+        self._subscribers[link_id] = time.monotonic()
+        if self._debug:
+            print("EVENTSTREAM -> Subscribed link: ", link_id)
+
+    def unsubscribe(self, link_id: int) -> None:
+        if link_id in self._subscribers:
+            del self._subscribers[link_id]
+            if self._debug:
+                print("EVENTSTREAM -> Unsubscribed link: ", link_id)
+
+    def close(self) -> None:
+        for link_id in self.subscribers:
+            self.unsubscribe(link_id)
+            try:
+                self._ap.socket_disconnect(link_id)
+            except OKError:
+                pass
+
+    def _send(self, link_id: int, buffer: bytes) -> bool:
+        try:
+            sent = self._ap.socket_send(link_id, buffer)
+        except (OKError, RuntimeError):
+            sent = False
+        if sent:
+            self._subscribers[link_id] = time.monotonic()
+        else:
+            self.unsubscribe(link_id)
+        return sent
+
+    def send(self, data: str, event: str = None, event_id: str = None, link_id: int = None) -> int:
+        """Push an event to link_id, or to every subscriber if it is None.
+        Returns the number of subscribers that received it."""
+        buffer = build_event(data, event, event_id)
+        link_ids = self.subscribers if link_id is None else [link_id]
+        sent_count = 0
+        for subscriber in link_ids:
+            if subscriber in self._subscribers and self._send(subscriber, buffer):
+                sent_count += 1
+        return sent_count
+
+    def keep_alive(self) -> None:
+        now = time.monotonic()
+        for link_id in self.subscribers:
+            if now - self._subscribers[link_id] >= self.keep_alive_interval:
+                self._send(link_id, KEEP_ALIVE_MESSAGE)
@@ -0,0 +1,42 @@
+import time
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """Serialized responses by request key, expiring after their TTL and
+    evicted least recently used first once max_bytes is exceeded."""
+
+    def __init__(self, max_bytes: int = 4096) -> None:
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        # key -> (expiry time, response bytes), least recently used first
+        self._entries = OrderedDict()
+
+    def get(self, key: str) -> bytes:
+        entry = self._entries.pop(key, None)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                self.size -= len(entry[1])
+            self.misses += 1
+            return None
+        self._entries[key] = entry
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: str, response: bytes, ttl: float) -> None:
+        if len(response) > self.max_bytes:
+            return
+        old_entry = self._entries.pop(key, None)
+        if old_entry is not None:
+            self.size -= len(old_entry[1])
+        self._entries[key] = (time.monotonic() + ttl, response)
+        self.size += len(response)
+        while self.size > self.max_bytes:
+            oldest_key = next(iter(self._entries))
+            self.size -= len(self._entries.pop(oldest_key)[1])
+
+    def clear(self) -> None:
+        self._entries = OrderedDict()
+        self.size = 0
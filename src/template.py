@@ -0,0 +1,113 @@
+try:
+    from typing import Dict, List, Iterator, Iterable, Tuple, Union
+    TemplatePart = Union[bytes, Tuple[str, bool]]
+except ImportError:
+    pass
+
+PLACEHOLDER_START = b"{{"
+PLACEHOLDER_END = b"}}"
+RAW_FILTER = "|raw"
+
+
+def escape_html(value: str) -> str:
+    value = value.replace("&", "&amp;")
+    value = value.replace("<", "&lt;")
+    value = value.replace(">", "&gt;")
+    value = value.replace('"', "&quot;")
+    return value.replace("'", "&#39;")
+
+
+def coalesce_chunks(chunks: Iterable[bytes], buffer_size: int = 512) -> Iterator[memoryview]:
+    """Gather small chunks into sends of buffer_size bytes through one
+    reused buffer, each yielded view is only valid until the next."""
+    buffer = memoryview(bytearray(buffer_size))
+    used = 0
+    for chunk in chunks:
+        pos = 0
+        chunk_length = len(chunk)
+        while pos < chunk_length:
+            count = min(buffer_size - used, chunk_length - pos)
+            buffer[used:used+count] = chunk[pos:pos+count]
+            used += count
+            pos += count
+            if used == buffer_size:
+                yield buffer
+                used = 0
+    if used:
+        yield buffer[:used]
+
+
+class Template:
+    """Template compiled into literal byte chunks and placeholder slots.
+    {{ name }} is replaced by the HTML escaped context value, {{ name|raw }}
+    by the value as is. Values may be str, bytes, numbers or iterables of
+    those (e.g. another template's render_chunks), which are streamed."""
+
+    def __init__(self, source: bytes) -> None:
+        self._parts: List[TemplatePart] = []
+        pos = 0
+        while True:
+            start = source.find(PLACEHOLDER_START, pos)
+            end = -1 if start < 0 else source.find(PLACEHOLDER_END, start)
+            if end < 0:
+                if pos < len(source):
+                    self._parts.append(bytes(source[pos:]))
+                break
+            if start > pos:
+                self._parts.append(bytes(source[pos:start]))
+            name = str(source[start+len(PLACEHOLDER_START):end], "utf-8").strip()
+            raw = name.endswith(RAW_FILTER)
+            if raw:
+                name = name[:-len(RAW_FILTER)].strip()
+            self._parts.append((name, raw))
+            pos = end + len(PLACEHOLDER_END)
+
+    def _render_value(self, value, raw: bool) -> Iterator[bytes]:
+        if value is None:
+            return
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            yield value
+        elif isinstance(value, str):
+            yield (value if raw else escape_html(value)).encode()
+        elif isinstance(value, (int, float)):
+            yield str(value).encode()
+        else:
+            for item in value:
+                yield from self._render_value(item, raw)
+
+    def render_chunks(self, context: Dict) -> Iterator[bytes]:
+        """Yield the rendered template piece by piece, without buffering"""
+        for part in self._parts:
+            if isinstance(part, bytes):
+                yield part
+            else:
+                yield from self._render_value(context.get(part[0]), part[1])
+
+    def render(self, context: Dict, buffer_size: int = 512) -> Iterator[memoryview]:
+        """Rendered template as a response body: chunks of buffer_size bytes"""
+        return coalesce_chunks(self.render_chunks(context), buffer_size)
+
+
+class TemplateLoader:
+    """Loads templates from root_dir, compiling each file once"""
+
+    def __init__(self, root_dir: str, buffer_size: int = 512) -> None:
+        self._root_dir = root_dir
+        self.buffer_size = buffer_size
+        self._templates: Dict[str, Template] = {}
+
+    def get(self, name: str) -> Template:
+        template = self._templates.get(name)
+        if template is None:
+            if name.find("..") >= 0:
+                raise ValueError("Invalid template name: " + name)
+            with open(self._root_dir + "/" + name.lstrip("/"), "rb") as f:
+                template = Template(f.read())
+            self._templates[name] = template
+        return template
+
+    def render(self, name: str, context: Dict) -> Iterator[memoryview]:
+        return self.get(name).render(context, self.buffer_size)
+
+    def clear(self) -> None:
+        self._templates = {}
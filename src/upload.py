@@ -0,0 +1,228 @@
+import os
+from webserver import get_header
+
+try:
+    from typing import List, Callable
+    from webserver import BodyHandler
+    PartHandler = Callable[[List[str]], None]
+    PartDataHandler = Callable[[memoryview], None]
+except ImportError:
+    pass
+
+
+class BufferedFileWriter:
+    """Writes a stream of small chunks to a file in buffer_size blocks, so flash
+    sees few large writes regardless of how the data was split on arrival."""
+
+    def __init__(self, path: str, buffer_size: int = 512) -> None:
+        self._file = open(path, "wb")
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+        self._used = 0
+        self.written = 0
+
+    def write(self, chunk: memoryview) -> None:
+        pos = 0
+        chunk_length = len(chunk)
+        while pos < chunk_length:
+            count = min(len(self._buffer) - self._used, chunk_length - pos)
+            self._view[self._used:self._used+count] = chunk[pos:pos+count]
+            self._used += count
+            pos += count
+            if self._used == len(self._buffer):
+                self.flush()
+        self.written += chunk_length
+
+    def flush(self) -> None:
+        if self._used:
+            self._file.write(self._view[:self._used])
+            self._used = 0
+
+    def close(self) -> None:
+        self.flush()
+        self._file.close()
+
+
+def remove_file(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def file_body_handler(path: str, buffer_size: int = 512) -> BodyHandler:
+    """Body handler storing the raw request body in the file at path. The
+    body is written to path + ".part" first and only replaces path once it
+    was received completely, an aborted upload leaves the old file as is."""
+    part_path = path + ".part"
+
+    def body_handler(req, chunk):
+        writer = req.get("body_writer")
+        if chunk is not None:
+            if writer is None:
+                writer = BufferedFileWriter(part_path, buffer_size)
+                req["body_writer"] = writer
+            writer.write(chunk)
+        elif req["body_received"] < req["body_length"]:
+            # Aborted, drop whatever arrived so far
+            if writer is not None:
+                writer.close()
+                remove_file(part_path)
+        else:
+            if writer is None:
+                writer = BufferedFileWriter(part_path, buffer_size)
+            writer.close()
+            # Renaming onto an existing file fails on FAT filesystems
+            remove_file(path)
+            os.rename(part_path, path)
+
+    return body_handler
+
+
+def get_header_param(header_value: str, name: str) -> str:
+    for param in header_value.split(";")[1:]:
+        separator_pos = param.find("=")
+        if separator_pos > -1 and param[:separator_pos].strip().lower() == name:
+            return param[separator_pos+1:].strip().strip('"')
+    return None
+
+
+class MultipartParser:
+    """Incremental multipart/form-data parser. Body chunks are fed as they
+    arrive; part data is handed to on_data without buffering the part, only
+    a delimiter-sized tail is kept between chunks."""
+
+    STATE_PREAMBLE = 0
+    STATE_DELIMITER = 1
+    STATE_HEADERS = 2
+    STATE_DATA = 3
+    STATE_END = 4
+
+    def __init__(self, boundary: str, on_part: PartHandler, on_data: PartDataHandler, on_part_end: Callable[[], None], max_header_size: int = 1024) -> None:
+        self._delimiter = b"\r\n--" + boundary.encode()
+        self._on_part = on_part
+        self._on_data = on_data
+        self._on_part_end = on_part_end
+        self._max_header_size = max_header_size
+        self._headers = b""
+        # The leading CRLF lets the first boundary match like the others
+        self._tail = b"\r\n"
+        self._state = self.STATE_PREAMBLE
+
+    def feed(self, chunk: memoryview) -> None:
+        data = self._tail + bytes(chunk)
+        self._tail = b""
+        pos = 0
+        while pos < len(data):
+            if self._state == self.STATE_PREAMBLE or self._state == self.STATE_DATA:
+                delimiter_pos = data.find(self._delimiter, pos)
+                if delimiter_pos < 0:
+                    keep = min(len(self._delimiter) - 1, len(data) - pos)
+                    if self._state == self.STATE_DATA and len(data) - keep > pos:
+                        self._on_data(memoryview(data)[pos:len(data)-keep])
+                    self._tail = data[len(data)-keep:]
+                    return
+                if self._state == self.STATE_DATA:
+                    if delimiter_pos > pos:
+                        self._on_data(memoryview(data)[pos:delimiter_pos])
+                    self._on_part_end()
+                pos = delimiter_pos + len(self._delimiter)
+                self._state = self.STATE_DELIMITER
+            elif self._state == self.STATE_DELIMITER:
+                if len(data) - pos < 2:
+                    self._tail = data[pos:]
+                    return
+                marker = data[pos:pos+2]
+                if marker == b"--":
+                    self._state = self.STATE_END
+                elif marker == b"\r\n":
+                    self._state = self.STATE_HEADERS
+                    pos += 2
+                else:
+                    raise ValueError("Malformed multipart boundary")
+            elif self._state == self.STATE_HEADERS:
+                self._headers += data[pos:]
+                headers_end = self._headers.find(b"\r\n\r\n")
+                if headers_end < 0:
+                    if len(self._headers) > self._max_header_size:
+                        raise ValueError("Multipart headers too large")
+                    return
+                headers = str(self._headers[:headers_end], "utf-8")
+                data = self._headers[headers_end+4:]
+                pos = 0
+                self._headers = b""
+                self._state = self.STATE_DATA
+                self._on_part(headers.split("\r\n"))
+            else:
+                return
+
+    def close(self) -> None:
+        if self._state != self.STATE_END:
+            raise ValueError("Incomplete multipart body")
+
+
+def multipart_body_handler(upload_dir: str, buffer_size: int = 512, max_field_size: int = 256) -> BodyHandler:
+    """Body handler for multipart/form-data uploads. File parts are streamed to
+    upload_dir under their (base) file name and listed in req["files"], other
+    fields are collected as strings in req["form"]."""
+
+    def body_handler(req, chunk):
+        parser = req.get("multipart")
+        if parser is None:
+            content_type = get_header(req, "Content-Type") or ""
+            boundary = get_header_param(content_type, "boundary")
+            if not content_type.startswith("multipart/form-data") or not boundary:
+                raise ValueError("Expected multipart/form-data body")
+            req["files"] = {}
+            req["form"] = {}
+            part = {}
+
+            def on_part(headers):
+                disposition = ""
+                for header_line in headers:
+                    if header_line.lower().startswith("content-disposition:"):
+                        disposition = header_line
+                part.clear()
+                part["name"] = get_header_param(disposition, "name")
+                filename = get_header_param(disposition, "filename")
+                if filename is None:
+                    part["value"] = bytearray()
+                    return
+                filename = filename.replace("\\", "/").split("/")[-1]
+                if filename not in ("", ".", ".."):
+                    file_path = upload_dir + "/" + filename
+                    part["writer"] = BufferedFileWriter(file_path, buffer_size)
+                    req["files"][part["name"]] = file_path
+
+            def on_data(data):
+                if "writer" in part:
+                    part["writer"].write(data)
+                elif "value" in part:
+                    if len(part["value"]) + len(data) > max_field_size:
+                        raise ValueError("Form field too large")
+                    part["value"] += data
+
+            def on_part_end():
+                if "writer" in part:
+                    part["writer"].close()
+                elif "value" in part:
+                    req["form"][part["name"]] = str(part["value"], "utf-8")
+                part.clear()
+
+            parser = MultipartParser(boundary, on_part, on_data, on_part_end)
+            req["multipart"] = parser
+            req["multipart_part"] = part
+
+        part = req["multipart_part"]
+
+        if chunk is not None:
+            parser.feed(chunk)
+        elif "writer" in part:
+            # Aborted in the middle of a file part, drop the partial file
+            part["writer"].close()
+            remove_file(req["files"].pop(part["name"]))
+            part.clear()
+        else:
+            parser.close()
+
+    return body_handler
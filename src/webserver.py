@@ -1,18 +1,29 @@
+import os
+import time
 from access_point import AccessPoint
+from access_point_pool import AccessPointPool
+from event_stream import EventStream
+from websocket import WebSocketSession, get_accept_key
+from bundle import AssetBundle
+from response_cache import ResponseCache
 from adafruit_espatcontrol.adafruit_espatcontrol import OKError
 try:
-    from typing import TypedDict, List, Dict, Tuple, Callable
+    from typing import TypedDict, List, Dict, Tuple, Callable, Iterator, Union
     HTTPRequest = TypedDict("HTTPRequest", {
                             "method": str, "route": str, "protocol_version": str, "headers": List[str], "body": bytearray})
     HTTPResponse = TypedDict("HTTPResponse", {
         "code": int, "status": str, "headers": List[str], "body": bytearray})
     RequestHandler = Callable[[HTTPRequest, HTTPResponse], None]
     MiddlewareHandler = Callable[[HTTPRequest, HTTPResponse], bool]
+    BodyHandler = Callable[[HTTPRequest, memoryview], None]
+    from websocket import MessageHandler, SessionHandler
 except ImportError:
     pass
 
 HTTP_STATUS_MESSGAES = {
+    101: "Switching Protocols",
     200: "OK",
+    206: "Partial Content",
     301: "Moved Permanently",
     302: "Found",
     303: "See Other",
@@ -23,9 +34,52 @@ HTTP_STATUS_MESSGAES = {
     401: "Unauthorized",
     403: "Forbidden",
     404: "Not Found",
+    411: "Length Required",
+    413: "Payload Too Large",
+    416: "Range Not Satisfiable",
     500: "Internal Server Error",
+    501: "Not Implemented",
+    503: "Service Unavailable",
 }
 
+# Header lines the server itself sends unchanged, encoded once
+CONSTANT_HEADER_LINES = (
+    "Content-Type: text/html",
+    "Content-Type: text/event-stream",
+    "Content-Encoding: gzip",
+    "Accept-Ranges: bytes",
+    "Cache-Control: no-cache",
+    "Vary: Accept-Encoding",
+    "Connection: close",
+    "Connection: Upgrade",
+    "Upgrade: websocket",
+)
+_encoded_header_lines = {line: line.encode() for line in CONSTANT_HEADER_LINES}
+# Status lines of known codes by (protocol version, code), filled on use
+_encoded_status_lines: Dict[Tuple[str, int], bytes] = {}
+
+
+def encode_line(line: str) -> bytes:
+    encoded_line = _encoded_header_lines.get(line)
+    return line.encode() if encoded_line is None else encoded_line
+
+
+def encode_status_line(protocol_version: str, code: int, status: str) -> bytes:
+    if protocol_version not in ("HTTP/1.0", "HTTP/1.1") or HTTP_STATUS_MESSGAES.get(code) != status:
+        # Custom statuses and odd versions are rare, don't keep them
+        return (protocol_version + " %d " % code + status).encode()
+    key = (protocol_version, code)
+    encoded_line = _encoded_status_lines.get(key)
+    if encoded_line is None:
+        encoded_line = (protocol_version + " %d " % code + status).encode()
+        _encoded_status_lines[key] = encoded_line
+    return encoded_line
+
+
+PRIORITY_LOW = -1
+PRIORITY_NORMAL = 0
+PRIORITY_HIGH = 1
+
 
 def build_http_response(code: int = 200, headers: List[str] = [], body: bytearray = bytearray()) -> HTTPRequest:
     status = "Unknown" if code not in HTTP_STATUS_MESSGAES else HTTP_STATUS_MESSGAES[code]
@@ -37,13 +91,139 @@ def build_http_response(code: int = 200, headers: List[str] = [], body: bytearra
     }
 
 
+def get_header(req: HTTPRequest, name: str) -> str:
+    name = name.lower()
+    for header_line in req["headers"]:
+        separator_pos = header_line.find(":")
+        if separator_pos > -1 and header_line[:separator_pos].strip().lower() == name:
+            return header_line[separator_pos+1:].strip()
+    return None
+
+
+class FileChunks:
+    """Iterator over length bytes of f from start, reusing one chunk_size
+    buffer. Used as a response body: f is closed once it was read to the end
+    or close() is called, also when no chunk was read yet."""
+
+    def __init__(self, f, start: int, length: int, chunk_size: int = 1024) -> None:
+        f.seek(start)
+        self._file = f
+        self._length = length
+        self._buffer = memoryview(bytearray(chunk_size))
+
+    def __iter__(self) -> "FileChunks":
+        return self
+
+    def __next__(self) -> memoryview:
+        count = 0
+        if self._file is not None and self._length > 0:
+            count = self._file.readinto(
+                self._buffer[:min(len(self._buffer), self._length)])
+        if not count:
+            self.close()
+            raise StopIteration
+        self._length -= count
+        return self._buffer[:count]
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def parse_range(range_header: str, size: int) -> Tuple[int, int]:
+    """Return the (start, end) of a single "bytes=" range, both inclusive.
+    None means the header should be ignored, (0, -1) that it can't be
+    satisfied."""
+    if not range_header.startswith("bytes=") or "," in range_header:
+        return None
+    range_parts = range_header[6:].strip().split("-")
+    if len(range_parts) != 2:
+        return None
+    (start_str, end_str) = range_parts
+    try:
+        if start_str == "":
+            suffix_length = int(end_str)
+            if suffix_length <= 0 or size == 0:
+                return (0, -1)
+            return (max(size - suffix_length, 0), size - 1)
+        start = int(start_str)
+        end = None if end_str == "" else int(end_str)
+    except ValueError:
+        return None
+    if end is not None and end < start:
+        # Syntactically invalid, not just unsatisfiable
+        return None
+    if start >= size:
+        return (0, -1)
+    return (start, size - 1 if end is None else min(end, size - 1))
+
+
+def build_overload_response(retry_after: int) -> bytes:
+    response_str = "HTTP/1.1 503 Service Unavailable\r\n"
+    response_str += "Retry-After: %d\r\n" % retry_after
+    response_str += "Content-Length: 0\r\n"
+    response_str += "Connection: close\r\n\r\n"
+    return response_str.encode()
+
+
+def is_http_request(data: bytearray) -> bool:
+    request_line_end = bytes(data[:128]).find(b"\r\n")
+    return request_line_end > 0 and bytes(data[request_line_end-9:request_line_end-3]) == b" HTTP/"
+
+
+def build_range_response(req: HTTPRequest, headers: List[str], size: int, read_range: Callable[[int, int], Iterator[memoryview]]) -> HTTPResponse:
+    """Response for size bytes of content, or the part of it selected by the
+    Range header. read_range(start, length) returns the body iterator."""
+    byte_range = None
+    range_header = get_header(req, "Range")
+    if range_header is not None:
+        byte_range = parse_range(range_header, size)
+    if byte_range is None:
+        return build_http_response(200, headers + [
+            "Accept-Ranges: bytes",
+            "Content-Length: %d" % size
+        ], read_range(0, size))
+    if byte_range[1] < byte_range[0]:
+        return build_http_response(416, headers + [
+            "Content-Range: bytes */%d" % size
+        ], b"Range not satisfiable!")
+    (start, end) = byte_range
+    return build_http_response(206, headers + [
+        "Accept-Ranges: bytes",
+        "Content-Range: bytes %d-%d/%d" % (start, end, size),
+        "Content-Length: %d" % (end - start + 1)
+    ], read_range(start, end - start + 1))
+
+
 class WebServer:
-    def __init__(self, ap: AccessPoint, debug: bool = False) -> None:
+    def __init__(self, ap: Union[AccessPoint, AccessPointPool], debug: bool = False, max_body_size: int = 2048, body_timeout: int = 10, send_chunk_size: int = 2048, max_load: int = 4, request_timeout: int = 10, retry_after: int = 5, cache_size: int = 4096) -> None:
         self._ap = ap
         self._debug = debug
         self.isListening = False
         self._handlers: Dict[str, Dict[str, RequestHandler]] = {}
+        self._route_options: Dict[str, Dict[str, Dict]] = {}
         self._middlewares: List[MiddlewareHandler] = []
+        # Largest body buffered in memory for regular (non streaming) handlers
+        self.max_body_size = max_body_size
+        self.body_timeout = body_timeout
+        # AT+CIPSEND accepts at most 2048 bytes at once
+        self.send_chunk_size = send_chunk_size
+        # Requests waiting for the rest of their body, by link id
+        self._streams: Dict[int, Dict] = {}
+        self._event_streams: Dict[str, EventStream] = {}
+        self._websockets: Dict[int, WebSocketSession] = {}
+        self._bundles: Dict[str, AssetBundle] = {}
+        # Responses whose body is still being sent, one chunk per turn each
+        self._transfers: List[Dict] = []
+        # Admitted requests waiting to be handled, served by route priority
+        self._queue: List[Dict] = []
+        # Queued requests and pending bodies above which new requests are
+        # shed, unless they outrank a queued one
+        self.max_load = max_load
+        self.request_timeout = request_timeout
+        self._overload_response = build_overload_response(retry_after)
+        self.response_cache = ResponseCache(cache_size)
 
     def listen(self, port: int) -> None:
         self.close()
@@ -67,16 +247,38 @@ class WebServer:
             ret[key] = value
         return ret
 
-    def register_handler(self, method: str, route: str, handler: RequestHandler) -> None:
+    def register_handler(self, method: str, route: str, handler: RequestHandler, priority: int = PRIORITY_NORMAL) -> None:
         if method not in self._handlers:
             self._handlers[method] = {}
+            self._route_options[method] = {}
         self._handlers[method][route] = handler
+        self._route_options[method][route] = {"priority": priority}
 
     def deregister_handler(self, method: str, route: str) -> None:
         if method in self._handlers:
             del self._handlers[method][route]
+            del self._route_options[method][route]
+
+    def enable_cache(self, method: str, route: str, ttl: float, vary_headers: List[str] = []) -> None:
+        """Cache the serialized 200 responses of a registered route for ttl
+        seconds. Requests share a cached response when method, route, query
+        and the listed request headers match; hits skip the handler."""
+        self._route_options[method][route]["cache"] = (ttl, vary_headers)
+
+    def disable_cache(self, method: str, route: str) -> None:
+        self._route_options[method][route].pop("cache", None)
 
-    def register_static_handler(self, route: str, file_root_dir: str) -> None:
+    def register_stream_handler(self, method: str, route: str, body_handler: BodyHandler, handler: RequestHandler, max_body_size: int = 1048576, priority: int = PRIORITY_NORMAL) -> None:
+        """Register a handler whose body is passed to body_handler chunk by chunk
+        as it arrives, instead of being buffered. body_handler is called with a
+        None chunk once the body ended (or was aborted), then handler runs if
+        the whole body was received."""
+        self.register_handler(method, route, handler, priority)
+        options = self._route_options[method][route]
+        options["body_handler"] = body_handler
+        options["max_body_size"] = max_body_size
+
+    def register_static_handler(self, route: str, file_root_dir: str, priority: int = PRIORITY_LOW) -> None:
 
         def handler(req, res):
             relative_path = "index.html" if req["route"] == route else req["route"][len(
@@ -88,24 +290,120 @@ class WebServer:
                     403, ["Content-Type: text/html"], b"Invalid file path!"))
             else:
                 try:
-
+                    # Opening fails for directories too, not only missing files
                     f = open(file_path, "rb")
-                    res.update(build_http_response(
-                        200, ["Content-Type: text/html"], f.read()))
-                    f.close()
-                except:
+                    size = os.stat(file_path)[6]
+                except OSError:
                     res.update(build_http_response(
                         404, ["Content-Type: text/html"], b"File not found!"))
+                    return
+                res.update(build_range_response(req, ["Content-Type: text/html"], size,
+                                                lambda start, length: FileChunks(f, start, length)))
+                if res["code"] == 416:
+                    f.close()
 
         self.register_handler(
-            "GET", route+"**" if route.endswith("/") else route+"/**", handler)
+            "GET", route+"**" if route.endswith("/") else route+"/**", handler, priority)
 
     def deregister_static_handler(self, route: str) -> None:
         self.deregister_handler(
             "GET", route+"**" if route.endswith("/") else route+"/**")
 
+    def register_bundle_handler(self, route: str, bundle_path: str, priority: int = PRIORITY_LOW) -> None:
+        """Serve the files packed into bundle_path by tools/pack_www.py.
+        Stored gzip variants are sent to clients accepting them."""
+        bundle = AssetBundle(bundle_path, self.send_chunk_size)
+
+        def handler(req, res):
+            relative_path = req["route"].split("?")[0][len(route):].lstrip("/")
+            entry = bundle.find(relative_path or "index.html")
+            if entry is None:
+                res.update(build_http_response(
+                    404, ["Content-Type: text/html"], b"File not found!"))
+                return
+            (content_type, offset, length, gzip_offset, gzip_length) = entry
+            headers = ["Content-Type: " + content_type]
+            if gzip_length:
+                headers.append("Vary: Accept-Encoding")
+                if "gzip" in (get_header(req, "Accept-Encoding") or ""):
+                    headers.append("Content-Encoding: gzip")
+                    offset = gzip_offset
+                    length = gzip_length
+            res.update(build_range_response(req, headers, length,
+                                            lambda start, count: bundle.read_chunks(offset + start, count)))
+
+        self._bundles[route] = bundle
+        self.register_handler(
+            "GET", route+"**" if route.endswith("/") else route+"/**", handler, priority)
+
+    def deregister_bundle_handler(self, route: str) -> None:
+        self.deregister_static_handler(route)
+        # Responses still being sent read from the bundle, end them first
+        handler_route = route+"**" if route.endswith("/") else route+"/**"
+        for transfer in list(self._transfers):
+            if transfer["route"] == handler_route:
+                self._release_link(transfer["link_id"])
+                self._disconnect(transfer["link_id"])
+        self._bundles.pop(route).close()
+
+    def register_event_stream(self, route: str, keep_alive_interval: int = 15) -> EventStream:
+        """Serve Server-Sent Events on route. Clients requesting it stay
+        subscribed to the returned EventStream until their link closes."""
+        event_stream = EventStream(self._ap, keep_alive_interval, self._debug)
+
+        def handler(req, res):
+            res.update(build_http_response(
+                200, ["Content-Type: text/event-stream", "Cache-Control: no-cache"]))
+            res["keep_open"] = True
+            res["on_sent"] = lambda: event_stream.subscribe(req["link_id"])
+
+        self.register_handler("GET", route, handler)
+        self._event_streams[route] = event_stream
+        return event_stream
+
+    def deregister_event_stream(self, route: str) -> None:
+        self.deregister_handler("GET", route)
+        self._event_streams.pop(route).close()
+
+    def register_websocket_handler(self, route: str, on_message: MessageHandler, on_open: SessionHandler = None, on_close: SessionHandler = None, max_message_size: int = 1024) -> None:
+        """Accept WebSocket upgrades on route. Each accepted link becomes a
+        WebSocketSession receiving its frames; on_open is called with it once
+        the handshake was sent. Binary messages reach on_message as a
+        memoryview that is reused for the next message, copy it to keep it."""
+
+        def session_closed(session):
+            # However it was closed, the link may carry a new client next
+            if self._websockets.get(session.link_id) is session:
+                del self._websockets[session.link_id]
+            if on_close:
+                on_close(session)
+
+        def handler(req, res):
+            key = get_header(req, "Sec-WebSocket-Key")
+            upgrade = get_header(req, "Upgrade") or ""
+            if key is None or upgrade.lower() != "websocket":
+                res.update(build_http_response(
+                    400, ["Content-Type: text/html"], b"WebSocket upgrade expected"))
+                return
+            res.update(build_http_response(101, [
+                "Upgrade: websocket",
+                "Connection: Upgrade",
+                "Sec-WebSocket-Accept: " + get_accept_key(key)
+            ]))
+            res["keep_open"] = True
+            session = WebSocketSession(
+                self._ap, req["link_id"], on_message, session_closed, max_message_size, self._debug)
+            self._websockets[req["link_id"]] = session
+            if on_open:
+                res["on_sent"] = lambda: on_open(session)
+
+        self.register_handler("GET", route, handler)
+
+    def deregister_websocket_handler(self, route: str) -> None:
+        self.deregister_handler("GET", route)
+
     def _get_handler(self, req: HTTPRequest) -> RequestHandler:
-        handlers_by_method = self._handlers[req["method"]]
+        handlers_by_method = self._handlers.get(req["method"])
         if handlers_by_method:
             req_route = req["route"]
 
@@ -138,6 +436,7 @@ class WebServer:
                             break
                     if found:
                         req["params"] = params
+                        req["handler_route"] = handler_route
                         if self._debug:
                             print("WEBSERVER -> Route handler found: ",
                                   handler_route)
@@ -158,70 +457,366 @@ class WebServer:
         return allow_through
 
     def _parse_http_request(self, data: bytearray) -> HTTPRequest:
-        lines = bytes(data).split(b"\r\n")
-        headers = []
-        headers_set = False
-        body_lines = []
-        method = None
-        route = None
-        protocol_version = None
-        for line in lines:
-            if method == None:
-                (method, route, protocol_version) = str(
-                    line, "utf-8").split(" ")
-            elif headers_set:
-                body_lines.append(line)
-            elif line == "":
-                headers_set = True
-            else:
-                headers.append(str(line, "utf-8"))
+        head_end = bytes(data).find(b"\r\n\r\n")
+        if head_end < 0:
+            head_end = len(data)
+        lines = str(data[:head_end], "utf-8").split("\r\n")
+        (method, route, protocol_version) = lines[0].split(" ")
 
         return {
             "method": method,
             "route": route,
             "protocol_version": protocol_version,
-            "headers": headers,
-            "body": b"\r\n".join(body_lines)
+            "headers": lines[1:],
+            "body": memoryview(data)[head_end+4:]
         }
 
-    def _build_http_response(self, req: HTTPRequest, res: HTTPResponse) -> bytearray:
-        response_lines = []
-        status_line_str = req["protocol_version"]
-        status_line_str += " %d" % res["code"]
-        status_line_str += " "+res["status"]
-        response_lines.append(status_line_str.encode())
+    def _build_http_head(self, req: HTTPRequest, res: HTTPResponse) -> bytes:
+        response_lines = [encode_status_line(
+            req["protocol_version"], res["code"], res["status"])]
         for header_line in res["headers"]:
-            response_lines.append(header_line.encode())
+            response_lines.append(encode_line(header_line))
+        response_lines.append(b"")
         response_lines.append(b"")
-        response_lines.append(bytes(res["body"]))
         return b"\r\n".join(response_lines)
 
-    def do_receive_cycle(self, timeout: int = 5) -> None:
+    def _build_http_response(self, req: HTTPRequest, res: HTTPResponse) -> bytearray:
+        return self._build_http_head(req, res) + bytes(res["body"])
+
+    def do_receive_cycle(self, timeout: int = 5, on_message: Callable[[Tuple[int, bytearray]], None] = None) -> None:
+        """Receive, handle queued requests and send the next chunk of each
+        response in progress. on_message (e.g. DnsServer.handle_message) is
+        passed every received message first, for other servers on the link."""
         if self._debug:
             print("WEBSERVER -> Waiting for request...")
-        message = self._ap.socket_receive(timeout)
-        self.handle_message(message)
+
+        def receive(receive_timeout):
+            message = self._ap.socket_receive(receive_timeout)
+            if on_message:
+                on_message(message)
+            self.queue_message(message)
+
+        # Don't wait for requests while there are responses to send
+        receive(0 if self._transfers else timeout)
+        # Take in whatever arrived meanwhile, so queued requests are served
+        # by priority and the excess is shed instead of left waiting
+        for _ in range(self.max_load):
+            if not self._ap.in_waiting:
+                break
+            receive(0.1)
+        self.process_queue()
+        self.send_transfers()
 
     def handle_message(self, message: Tuple[int, bytearray]) -> None:
+        self.queue_message(message)
+        self.process_queue()
+        while self._transfers:
+            self.send_transfers()
+
+    def queue_message(self, message: Tuple[int, bytearray]) -> None:
+        """Receive a message without handling complete requests, those are
+        queued until process_queue is called."""
         (link_id, data) = message
-        if link_id in range(0, self._ap.conn_limit):
-            req = self._parse_http_request(data)
+        for closed_link_id in self._ap.pop_closed_links():
+            self._release_link(closed_link_id)
+        self._expire_streams()
+        for event_stream in self._event_streams.values():
+            event_stream.keep_alive()
+        if link_id in self._websockets:
+            self._websockets[link_id].feed(data)
+        elif link_id in self._streams:
+            self._receive_body(link_id, data)
+        elif self._ap.is_client_link(link_id):
+            if not is_http_request(data):
+                # e.g. the rest of a body rejected with 413, still arriving
+                # after the response was sent and the link closed
+                if self._debug:
+                    print("WEBSERVER -> Dropping data on link: ", link_id)
+                return
+            # A new request means whatever held this link before is gone
+            self._release_link(link_id)
+            try:
+                req = self._parse_http_request(data)
+                req["link_id"] = link_id
+                handler = self._get_handler(req)
+            except (ValueError, UnicodeError):
+                if self._debug:
+                    print("WEBSERVER -> Malformed request on link: ", link_id)
+                self._disconnect(link_id)
+                return
+            req["deadline"] = time.monotonic() + self.request_timeout
             res = build_http_response()
 
-            handler = self._get_handler(req)
             if handler:
-                if self._apply_middlewares(req, res):
-                    if self._debug:
-                        print("WEBSERVER -> Request:", req)
-                    handler(req, res)
+                options = self._route_options[req["method"]][req["handler_route"]]
+                req["priority"] = options["priority"]
+                content_length = get_header(req, "Content-Length")
+                try:
+                    body_length = 0 if content_length is None else int(
+                        content_length)
+                except ValueError:
+                    body_length = -1
+                max_body_size = options.get(
+                    "max_body_size", self.max_body_size)
+                if body_length < 0:
+                    res = build_http_response(
+                        code=400, body=b"Invalid Content-Length")
+                elif get_header(req, "Transfer-Encoding") is not None:
+                    # Chunked bodies aren't decoded
+                    res = build_http_response(
+                        code=501, body=b"Transfer-Encoding not supported")
+                elif "body_handler" in options and content_length is None:
+                    # The body may only follow in a later packet
+                    res = build_http_response(
+                        code=411, body=b"Content-Length required")
+                elif body_length > max_body_size:
+                    res = build_http_response(
+                        code=413, body=b"Request body too large")
+                elif not self._admit(req):
+                    return
+                elif self._apply_middlewares(req, res):
+                    body = req["body"][:body_length]
+                    if "body_handler" in options:
+                        body_handler = options["body_handler"]
+                    else:
+                        body_handler = self._buffer_body
+                        req["body"] = bytearray(body_length)
+                    stream = {
+                        "req": req,
+                        "res": res,
+                        "handler": handler,
+                        "options": options,
+                        "body_handler": body_handler,
+                        "received": 0,
+                        "stamp": time.monotonic()
+                    }
+                    req["body_length"] = body_length
+                    self._streams[link_id] = stream
+                    self._receive_body(link_id, body)
+                    return
             else:
                 error_message = "Cannot "+req["method"]+" "+req["route"]
                 res = build_http_response(
                     code=404, body=error_message.encode())
+            self._send_response(link_id, req, res)
+        elif link_id >= 0 and is_http_request(data):
+            # Beyond conn_limit, answer instead of leaving the client hanging
+            self._shed(link_id)
+
+    def _shed(self, link_id: int) -> None:
+        if self._debug:
+            print("WEBSERVER -> Overloaded, shedding link: ", link_id)
+        self._send_chunked(link_id, self._overload_response)
+        self._disconnect(link_id)
+
+    def _admit(self, req: HTTPRequest) -> bool:
+        if len(self._queue) + len(self._streams) + len(self._transfers) < self.max_load:
+            return True
+        lowest = None
+        for entry in self._queue:
+            if "body_handler" in entry["options"]:
+                # Its body handler may have stored the upload already
+                continue
+            if lowest is None or entry["req"]["priority"] <= lowest["req"]["priority"]:
+                lowest = entry
+        if lowest is not None and lowest["req"]["priority"] < req["priority"]:
+            self._queue.remove(lowest)
+            self._shed(lowest["req"]["link_id"])
+            return True
+        self._shed(req["link_id"])
+        return False
+
+    def process_queue(self) -> None:
+        while self._queue:
+            entry = self._queue[0]
+            for queued in self._queue:
+                if queued["req"]["priority"] > entry["req"]["priority"]:
+                    entry = queued
+            self._queue.remove(entry)
+            req = entry["req"]
+            res = entry["res"]
+            if time.monotonic() > req["deadline"]:
+                # The client has most likely given up already
+                if self._debug:
+                    print("WEBSERVER -> Request expired on link: ",
+                          req["link_id"])
+                self._disconnect(req["link_id"])
+                continue
             if self._debug:
-                print("WEBSERVER -> Response:", res)
-            self._ap.socket_send(link_id, self._build_http_response(req, res))
+                print("WEBSERVER -> Request:", req)
+            if "cache" in entry["options"]:
+                self._serve_cached(entry)
+            else:
+                entry["handler"](req, res)
+                self._send_response(req["link_id"], req, res)
+
+    def _serve_cached(self, entry: Dict) -> None:
+        req = entry["req"]
+        res = entry["res"]
+        (ttl, vary_headers) = entry["options"]["cache"]
+        cache_key = req["method"] + " " + req["route"] + " " + req["protocol_version"]
+        for header_name in vary_headers:
+            cache_key += "\n" + (get_header(req, header_name) or "")
+        response = self.response_cache.get(cache_key)
+        if response is None:
+            entry["handler"](req, res)
+            if res["code"] != 200 or "on_sent" in res or res.get("keep_open") \
+                    or not isinstance(res["body"], (bytes, bytearray, memoryview)):
+                self._send_response(req["link_id"], req, res)
+                return
+            response = self._build_http_response(req, res)
+            self.response_cache.put(cache_key, response, ttl)
+        elif self._debug:
+            print("WEBSERVER -> Cache hit: ", cache_key)
+        self._send_chunked(req["link_id"], response)
+        self._disconnect(req["link_id"])
+
+    def _buffer_body(self, req: HTTPRequest, chunk: memoryview) -> None:
+        if chunk is not None:
+            received = req["body_received"]
+            req["body"][received:received+len(chunk)] = chunk
+
+    def _receive_body(self, link_id: int, data: bytearray) -> None:
+        stream = self._streams[link_id]
+        req = stream["req"]
+        res = stream["res"]
+        chunk = memoryview(data)[:req["body_length"] - stream["received"]]
+        req["body_received"] = stream["received"]
+        stream["stamp"] = time.monotonic()
+        try:
+            if len(chunk):
+                stream["body_handler"](req, chunk)
+                stream["received"] += len(chunk)
+                req["body_received"] = stream["received"]
+            if stream["received"] < req["body_length"]:
+                return
+            del self._streams[link_id]
+            stream["body_handler"](req, None)
+        except ValueError as err:
+            self._abort_stream(link_id)
+            res = build_http_response(code=400, body=str(err).encode())
+            self._send_response(link_id, req, res)
+            return
+        except OSError as err:
+            # e.g. a read-only filesystem or missing upload directory
+            if self._debug:
+                print("WEBSERVER -> Body handler failed: ", err)
+            self._abort_stream(link_id)
+            res = build_http_response(code=500, body=b"Cannot store request body")
+            self._send_response(link_id, req, res)
+            return
+        # The request only starts waiting once its body is in, streamed
+        # uploads may take longer than request_timeout to arrive
+        req["deadline"] = time.monotonic() + self.request_timeout
+        self._queue.append(stream)
+
+    def _abort_stream(self, link_id: int) -> None:
+        stream = self._streams.pop(link_id, None)
+        if stream:
             try:
-                self._ap.socket_disconnect(link_id)
-            except OKError:
+                stream["body_handler"](stream["req"], None)
+            except (ValueError, OSError):
                 pass
+
+    def _release_link(self, link_id: int) -> None:
+        self._abort_stream(link_id)
+        for entry in self._queue:
+            if entry["req"]["link_id"] == link_id:
+                self._queue.remove(entry)
+                break
+        for event_stream in self._event_streams.values():
+            event_stream.unsubscribe(link_id)
+        session = self._websockets.pop(link_id, None)
+        if session:
+            session._closed()
+        for transfer in self._transfers:
+            if transfer["link_id"] == link_id:
+                self._transfers.remove(transfer)
+                self._close_body(transfer["res"]["body"])
+                break
+
+    def _expire_streams(self) -> None:
+        now = time.monotonic()
+        for link_id in list(self._streams):
+            if now - self._streams[link_id]["stamp"] > self.body_timeout:
+                if self._debug:
+                    print("WEBSERVER -> Body timed out on link: ", link_id)
+                self._abort_stream(link_id)
+                self._disconnect(link_id)
+
+    def _send_chunked(self, link_id: int, buffer: bytes) -> bool:
+        view = memoryview(buffer)
+        try:
+            for pos in range(0, len(view), self.send_chunk_size):
+                if not self._ap.socket_send(link_id, view[pos:pos+self.send_chunk_size]):
+                    return False
+        except (OKError, RuntimeError):
+            # The module raises when the client went away mid send
+            return False
+        return True
+
+    def _send_response(self, link_id: int, req: HTTPRequest, res: HTTPResponse) -> None:
+        if self._debug:
+            print("WEBSERVER -> Response:", res)
+        body = res["body"]
+        if isinstance(body, (bytes, bytearray, memoryview)):
+            self._send_chunked(link_id, self._build_http_response(req, res))
+        elif self._send_chunked(link_id, self._build_http_head(req, res)):
+            # Body is an iterator of chunks, e.g. FileChunks. It is
+            # sent by send_transfers, interleaved with other responses.
+            self._transfers.append({
+                "link_id": link_id,
+                "res": res,
+                "chunks": iter(body),
+                "route": req.get("handler_route"),
+                "deadline": req["deadline"]
+            })
+            return
+        else:
+            self._close_body(body)
+        self._finish_response(link_id, res)
+
+    def send_transfers(self) -> None:
+        """Send the next chunk of every response body still in progress"""
+        for transfer in list(self._transfers):
+            link_id = transfer["link_id"]
+            chunk = None
+            sent = False
+            try:
+                if time.monotonic() > transfer["deadline"]:
+                    # No chunk got through for request_timeout
+                    if self._debug:
+                        print("WEBSERVER -> Transfer expired on link: ", link_id)
+                    chunk = b""
+                else:
+                    chunk = next(transfer["chunks"], None)
+                    sent = chunk is not None and self._send_chunked(link_id, chunk)
+                if sent:
+                    transfer["deadline"] = time.monotonic() + self.request_timeout
+            finally:
+                if not sent:
+                    self._transfers.remove(transfer)
+                    self._close_body(transfer["res"]["body"])
+            if chunk is None:
+                self._finish_response(link_id, transfer["res"])
+            elif not sent:
+                # Client gone, drop whatever else was waiting on the link
+                self._release_link(link_id)
+                self._disconnect(link_id)
+
+    def _close_body(self, body: Iterator[memoryview]) -> None:
+        if hasattr(body, "close"):
+            body.close()
+
+    def _finish_response(self, link_id: int, res: HTTPResponse) -> None:
+        if "on_sent" in res:
+            res["on_sent"]()
+        if res.get("keep_open"):
+            return
+        self._disconnect(link_id)
+
+    def _disconnect(self, link_id: int) -> None:
+        try:
+            self._ap.socket_disconnect(link_id)
+        except OKError:
+            pass
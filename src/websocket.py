@@ -0,0 +1,242 @@
+import binascii
+from access_point import AccessPoint
+from adafruit_espatcontrol.adafruit_espatcontrol import OKError
+
+try:
+    import hashlib
+except ImportError:
+    import adafruit_hashlib as hashlib
+
+try:
+    from typing import Callable, Union
+    MessageHandler = Callable[["WebSocketSession", Union[str, memoryview]], None]
+    SessionHandler = Callable[["WebSocketSession"], None]
+except ImportError:
+    pass
+
+WEBSOCKET_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+OPCODE_CONTINUATION = 0x0
+OPCODE_TEXT = 0x1
+OPCODE_BINARY = 0x2
+OPCODE_CLOSE = 0x8
+OPCODE_PING = 0x9
+OPCODE_PONG = 0xA
+OPCODES = (OPCODE_CONTINUATION, OPCODE_TEXT, OPCODE_BINARY,
+           OPCODE_CLOSE, OPCODE_PING, OPCODE_PONG)
+
+CLOSE_NORMAL = 1000
+CLOSE_PROTOCOL_ERROR = 1002
+CLOSE_INVALID_DATA = 1007
+CLOSE_TOO_BIG = 1009
+
+
+def get_accept_key(key: str) -> str:
+    digest = hashlib.sha1(key.encode() + WEBSOCKET_GUID).digest()
+    return str(binascii.b2a_base64(digest), "utf-8").strip()
+
+
+class WebSocketSession:
+    """WebSocket connection on a link handed over by WebServer after the
+    upgrade handshake. Incoming +IPD data is fed to feed(); frames may be
+    split across or packed into packets. All buffers are allocated once per
+    session, payloads are unmasked in place; binary messages are passed to
+    on_message as a view of the message buffer, valid only during the call."""
+
+    STATE_HEADER = 0
+    STATE_PAYLOAD = 1
+
+    def __init__(self, ap: AccessPoint, link_id: int, on_message: MessageHandler, on_close: SessionHandler = None, max_message_size: int = 1024, debug: bool = False) -> None:
+        self._ap = ap
+        self._debug = debug
+        self.link_id = link_id
+        self.on_message = on_message
+        self.on_close = on_close
+        self.closed = False
+        self.max_message_size = max_message_size
+
+        self._header = bytearray(14)
+        self._header_length = 0
+        self._state = self.STATE_HEADER
+        self._message = bytearray(max_message_size)
+        self._message_length = 0
+        self._message_opcode = 0
+        self._control = bytearray(125)
+        # Also fits a pong echoing the largest allowed ping payload
+        self._send_buffer = bytearray(max(max_message_size, 125) + 10)
+        self._send_view = memoryview(self._send_buffer)
+
+        self._opcode = 0
+        self._fin = False
+        self._mask = bytearray(4)
+        self._payload_length = 0
+        self._payload_read = 0
+
+    def _header_size(self) -> int:
+        size = 2
+        if self._header_length >= 2:
+            length_byte = self._header[1] & 0x7F
+            if length_byte == 126:
+                size += 2
+            elif length_byte == 127:
+                size += 8
+            if self._header[1] & 0x80:
+                size += 4
+        return size
+
+    def _parse_header(self) -> bool:
+        self._fin = bool(self._header[0] & 0x80)
+        self._opcode = self._header[0] & 0x0F
+        if not self._header[1] & 0x80:
+            # Client frames must be masked
+            self.close(CLOSE_PROTOCOL_ERROR)
+            return False
+        if self._header[0] & 0x70 or self._opcode not in OPCODES:
+            # No extensions are negotiated, so RSV bits must be clear
+            self.close(CLOSE_PROTOCOL_ERROR)
+            return False
+        length_byte = self._header[1] & 0x7F
+        pos = 2
+        if length_byte == 126:
+            self._payload_length = int.from_bytes(
+                bytes(self._header[2:4]), "big")
+            pos = 4
+        elif length_byte == 127:
+            self._payload_length = int.from_bytes(
+                bytes(self._header[2:10]), "big")
+            pos = 10
+        else:
+            self._payload_length = length_byte
+        self._mask[0:4] = self._header[pos:pos+4]
+        self._payload_read = 0
+
+        if self._opcode >= OPCODE_CLOSE:
+            if self._payload_length > len(self._control) or not self._fin:
+                self.close(CLOSE_PROTOCOL_ERROR)
+                return False
+        else:
+            # A continuation needs a message in progress, any other data
+            # frame must not interrupt one
+            if (self._opcode == OPCODE_CONTINUATION) != bool(self._message_opcode):
+                self.close(CLOSE_PROTOCOL_ERROR)
+                return False
+            if self._opcode != OPCODE_CONTINUATION:
+                self._message_opcode = self._opcode
+                self._message_length = 0
+            if self._message_length + self._payload_length > self.max_message_size:
+                self.close(CLOSE_TOO_BIG)
+                return False
+        return True
+
+    def feed(self, data: bytearray) -> None:
+        pos = 0
+        data_length = len(data)
+        while pos < data_length and not self.closed:
+            if self._state == self.STATE_HEADER:
+                self._header[self._header_length] = data[pos]
+                self._header_length += 1
+                pos += 1
+                if self._header_length == self._header_size():
+                    self._header_length = 0
+                    if not self._parse_header():
+                        return
+                    self._state = self.STATE_PAYLOAD
+            if self._state == self.STATE_PAYLOAD:
+                if self._opcode >= OPCODE_CLOSE:
+                    target = self._control
+                    offset = 0
+                else:
+                    target = self._message
+                    offset = self._message_length
+                count = min(self._payload_length -
+                            self._payload_read, data_length - pos)
+                mask = self._mask
+                read = self._payload_read
+                for i in range(count):
+                    target[offset+read+i] = data[pos+i] ^ mask[(read+i) & 3]
+                self._payload_read += count
+                pos += count
+                if self._payload_read == self._payload_length:
+                    self._state = self.STATE_HEADER
+                    self._frame_complete()
+
+    def _frame_complete(self) -> None:
+        if self._opcode == OPCODE_PING:
+            self._send_frame(
+                OPCODE_PONG, memoryview(self._control)[:self._payload_length])
+        elif self._opcode == OPCODE_CLOSE:
+            self.close(CLOSE_NORMAL)
+        elif self._opcode == OPCODE_PONG:
+            pass
+        else:
+            self._message_length += self._payload_length
+            if self._fin:
+                message = memoryview(self._message)[:self._message_length]
+                self._message_length = 0
+                message_opcode = self._message_opcode
+                self._message_opcode = 0
+                if message_opcode == OPCODE_TEXT:
+                    try:
+                        message = str(bytes(message), "utf-8")
+                    except UnicodeError:
+                        self.close(CLOSE_INVALID_DATA)
+                        return
+                if self._debug:
+                    print("WEBSOCKET -> Message on link: ", self.link_id)
+                self.on_message(self, message)
+
+    def _send_frame(self, opcode: int, payload: memoryview) -> bool:
+        payload_length = len(payload)
+        if payload_length > len(self._send_buffer) - 10:
+            raise ValueError("Message too large")
+        self._send_buffer[0] = 0x80 | opcode
+        if payload_length < 126:
+            self._send_buffer[1] = payload_length
+            pos = 2
+        elif payload_length < 65536:
+            self._send_buffer[1] = 126
+            self._send_buffer[2:4] = payload_length.to_bytes(2, "big")
+            pos = 4
+        else:
+            self._send_buffer[1] = 127
+            self._send_buffer[2:10] = payload_length.to_bytes(8, "big")
+            pos = 10
+        self._send_view[pos:pos+payload_length] = payload
+        try:
+            sent = self._ap.socket_send(
+                self.link_id, self._send_view[:pos+payload_length])
+        except (OKError, RuntimeError):
+            sent = False
+        if not sent and opcode != OPCODE_CLOSE:
+            self._closed()
+        return sent
+
+    def send(self, message: Union[str, bytes]) -> bool:
+        """Send a text message for str, a binary one otherwise"""
+        if self.closed:
+            return False
+        if isinstance(message, str):
+            return self._send_frame(OPCODE_TEXT, message.encode())
+        return self._send_frame(OPCODE_BINARY, message)
+
+    def ping(self, payload: bytes = b"") -> bool:
+        return not self.closed and self._send_frame(OPCODE_PING, payload)
+
+    def close(self, code: int = CLOSE_NORMAL) -> None:
+        if self.closed:
+            return
+        self._send_frame(OPCODE_CLOSE, code.to_bytes(2, "big"))
+        try:
+            self._ap.socket_disconnect(self.link_id)
+        except OKError:
+            pass
+        self._closed()
+
+    def _closed(self) -> None:
+        """Mark the session closed, the link is already gone"""
+        if not self.closed:
+            self.closed = True
+            if self._debug:
+                print("WEBSOCKET -> Closed link: ", self.link_id)
+            if self.on_close:
+                self.on_close(self)
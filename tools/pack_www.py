@@ -0,0 +1,91 @@
+"""Pack a www directory into one asset bundle for WebServer.register_bundle_handler.
+
+Runs on the host with CPython:
+
+    python tools/pack_www.py exmaples/static_hosting/www www.bundle --gzip
+"""
+import argparse
+import gzip
+import mimetypes
+import os
+import struct
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), "..", "src"))
+from bundle import BUNDLE_MAGIC, BUNDLE_VERSION, HEADER_FORMAT, HEADER_SIZE, RECORD_FORMAT, RECORD_SIZE  # noqa: E402
+
+COMPRESSIBLE_TYPES = ("text/", "application/javascript",
+                      "application/json", "image/svg+xml")
+
+
+def collect_files(root_dir):
+    files = []
+    for dir_path, _, file_names in os.walk(root_dir):
+        for file_name in file_names:
+            file_path = os.path.join(dir_path, file_name)
+            name = os.path.relpath(file_path, root_dir).replace(os.sep, "/")
+            files.append((name.encode(), file_path))
+    files.sort()
+    return files
+
+
+def pack_directory(root_dir, bundle_path, use_gzip=False):
+    files = collect_files(root_dir)
+    if len(files) > 0xFFFF:
+        raise ValueError("Too many files for one bundle")
+
+    content_types = []
+    names = b""
+    entries = []
+    for (name, file_path) in files:
+        content_type = mimetypes.guess_type(file_path)[0] or "application/octet-stream"
+        if content_type not in content_types:
+            content_types.append(content_type)
+        with open(file_path, "rb") as f:
+            data = f.read()
+        gzip_data = b""
+        if use_gzip and content_type.startswith(COMPRESSIBLE_TYPES):
+            gzip_data = gzip.compress(data, 9, mtime=0)
+            if len(gzip_data) >= len(data):
+                gzip_data = b""
+        entries.append((len(names), len(name),
+                       content_types.index(content_type), data, gzip_data))
+        names += name
+
+    types_table = b"".join(bytes([len(content_type)]) + content_type.encode()
+                           for content_type in content_types)
+    types_offset = HEADER_SIZE + len(entries) * RECORD_SIZE
+    names_offset = types_offset + len(types_table)
+    data_offset = names_offset + len(names)
+
+    records = b""
+    data_area = b""
+    for (name_offset, name_length, type_index, data, gzip_data) in entries:
+        offset = data_offset + len(data_area)
+        data_area += data
+        gzip_offset = data_offset + len(data_area)
+        data_area += gzip_data
+        records += struct.pack(RECORD_FORMAT, name_offset, name_length, type_index, 0,
+                               offset, len(data), gzip_offset if gzip_data else 0, len(gzip_data))
+
+    header = struct.pack(HEADER_FORMAT, BUNDLE_MAGIC, BUNDLE_VERSION, len(content_types),
+                         len(entries), types_offset, names_offset, data_offset)
+    with open(bundle_path, "wb") as f:
+        f.write(header + records + types_table + names + data_area)
+    return len(entries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("root_dir", help="directory to pack")
+    parser.add_argument("bundle_path", help="bundle file to write")
+    parser.add_argument("--gzip", action="store_true",
+                        help="also store gzip variants of text assets")
+    args = parser.parse_args()
+    count = pack_directory(args.root_dir, args.bundle_path, args.gzip)
+    print("Packed %d files into %s" % (count, args.bundle_path))
+
+
+if __name__ == "__main__":
+    main()